@@ -3,11 +3,14 @@ downloader.py - File Download Module
 """
 import os
 import re
-import requests
+import errno
+import asyncio
+import aiohttp
+import shutil
+import socket
 import tempfile
-import math
 import logging
-from typing import Callable, Optional
+from typing import Awaitable, Callable, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +18,94 @@ logger = logging.getLogger(__name__)
 CONNECT_TIMEOUT = 30
 READ_TIMEOUT = 1800  # 30 minutes for large files
 
-# Chunk size for streaming (8KB)
-CHUNK_SIZE = 8192
+# Chunk size for streaming (256KB)
+CHUNK_SIZE = 256 * 1024
+
+# Write buffer for the temp file (1MB), coalesces chunks into fewer syscalls
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Connection pool settings for the shared HTTP session
+POOL_LIMIT = 64
+POOL_LIMIT_PER_HOST = 32
+KEEPALIVE_TIMEOUT = 75  # seconds to keep idle connections open
+
+# Receive buffer for download sockets (4MB), enough for ~1 Gbps at 30 ms RTT
+SOCKET_RCVBUF = 4 * 1024 * 1024
+
+# Retry policy for transient gateway errors
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled on each attempt
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+# Parallel ranged downloads for large files
+RANGE_PARTS = 4
+MIN_RANGE_SIZE = 32 * 1024 * 1024  # 32MB, smaller files use a single stream
+
+# Expected Content-Range of a ranged response, e.g. "bytes 0-1023/4096"
+_CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+# Characters that are illegal in filenames, mapped to '_' for str.translate
+_BAD_CHARS = dict.fromkeys(map(ord, '<>:"/\\|?*'), ord('_'))
+_BAD_CHARS.update({i: ord('_') for i in range(0x20)})
+
+# Max filename length in bytes (255 on ext4, NTFS, HFS+ and most others)
+MAX_FILENAME_BYTES = 255
+
+# Content-Disposition filename pattern, compiled once at import
+_CD_RE = re.compile(r'filename\*?=(["\']?)(.+?)\1(?:;|$)')
+
+# Shared HTTP session (created lazily inside the running event loop)
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def _rcvbuf_limit() -> int:
+    """Largest SO_RCVBUF the kernel will grant, 0 if unknown."""
+    try:
+        with open('/proc/sys/net/core/rmem_max') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def _download_socket(addr_info: tuple) -> socket.socket:
+    """Create a TCP socket with a large receive buffer for downloads."""
+    family, type_, proto, _, _ = addr_info
+    sock = socket.socket(family=family, type=type_, proto=proto)
+    # Before connect(), so the window scale is negotiated for it
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+    return sock
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Return the shared aiohttp session, creating it on first use.
+    Reusing one session keeps TCP/TLS connections alive between downloads.
+    """
+    global _session
+    if _session is None or _session.closed:
+        # A fixed SO_RCVBUF turns off kernel autotuning and gets clamped to
+        # rmem_max, so only pin it when the kernel allows the full size
+        set_rcvbuf = _rcvbuf_limit() >= SOCKET_RCVBUF
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            socket_factory=_download_socket if set_rcvbuf else None
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            # Media is already compressed, don't spend CPU on gzip
+            headers={'Accept-Encoding': 'identity'}
+        )
+    return _session
+
+
+async def close_session() -> None:
+    """Close the shared aiohttp session if it was opened."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
 
 
 def sanitize_filename(filename: str) -> str:
@@ -25,7 +114,7 @@ def sanitize_filename(filename: str) -> str:
     Prevents path traversal and other file system attacks.
     """
     # Remove path separators and other dangerous characters
-    filename = re.sub(r'[<>:"/\\|?*\x00-\x1f]', '_', filename)
+    filename = filename.translate(_BAD_CHARS)
     
     # Remove leading/trailing dots and spaces
     filename = filename.strip('. ')
@@ -34,10 +123,21 @@ def sanitize_filename(filename: str) -> str:
     if not filename:
         filename = "downloaded_file"
     
-    # Limit filename length (255 is max on most systems)
-    if len(filename) > 255:
+    # UTF-8 uses at most 4 bytes per character, so short names always fit
+    if len(filename) <= MAX_FILENAME_BYTES // 4:
+        return filename
+    
+    # Limit filename length in bytes, keeping the extension intact
+    encoded = filename.encode('utf-8', 'ignore')
+    if len(encoded) > MAX_FILENAME_BYTES:
         name, ext = os.path.splitext(filename)
-        filename = name[:250] + ext
+        ext_bytes = ext.encode('utf-8', 'ignore')
+        if len(ext_bytes) >= MAX_FILENAME_BYTES // 2:
+            # Not a real extension, truncate the whole name
+            name, ext, ext_bytes = filename, '', b''
+        name_bytes = name.encode('utf-8', 'ignore')[:MAX_FILENAME_BYTES - len(ext_bytes)]
+        # 'ignore' drops a multi-byte character cut in half by the slice
+        filename = name_bytes.decode('utf-8', 'ignore') + ext
     
     return filename
 
@@ -68,7 +168,7 @@ def extract_filename_from_headers(headers: dict) -> Optional[str]:
         return None
     
     # Look for filename*= or filename= patterns
-    matches = re.findall(r'filename\*?=(["\']?)(.+?)\1(?:;|$)', content_disposition)
+    matches = _CD_RE.findall(content_disposition)
     if matches:
         filename = matches[0][1]
         # Remove encoding prefix if present (e.g., UTF-8'')
@@ -79,132 +179,428 @@ def extract_filename_from_headers(headers: dict) -> Optional[str]:
     return None
 
 
-def download_file(
+async def _get_with_retries(
+    session: aiohttp.ClientSession,
     url: str,
-    progress_callback: Optional[Callable[[int], None]] = None,
-    timeout: int = READ_TIMEOUT
+    timeout: aiohttp.ClientTimeout
+) -> aiohttp.ClientResponse:
+    """
+    Send a GET request, retrying transient gateway errors with backoff.
+    The caller is responsible for releasing the returned response.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        response = await session.get(url, timeout=timeout, allow_redirects=True)
+        if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            return response
+        
+        response.release()
+        delay = RETRY_BACKOFF * (2 ** attempt)
+        logger.warning(f"HTTP {response.status} from {url}, retrying in {delay}s")
+        await asyncio.sleep(delay)
+
+
+def remove_download(local_path: str) -> None:
+    """Delete a downloaded file together with its private temp directory."""
+    shutil.rmtree(os.path.dirname(local_path), ignore_errors=True)
+
+
+def _open_download(local_path: str, total_size: int) -> Tuple[int, bool]:
+    """
+    Open the file for local_path and reserve total_size bytes on disk.
+    
+    Where supported (Linux) this is an unnamed O_TMPFILE inode in the same
+    directory, which only shows up at local_path once _publish() links it.
+    An interrupted download then leaves no partial file behind.
+    
+    Returns:
+        Tuple of (fd: int, is_anonymous: bool)
+    """
+    fd = None
+    if hasattr(os, 'O_TMPFILE'):
+        try:
+            # Readable too, in case _publish() has to copy the data out
+            fd = os.open(os.path.dirname(local_path), os.O_TMPFILE | os.O_RDWR, 0o600)
+            is_anonymous = True
+        except OSError as e:
+            # Old kernels report EISDIR, unsupported file systems EOPNOTSUPP
+            if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL):
+                raise
+    
+    if fd is None:
+        fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        is_anonymous = False
+    
+    if total_size <= 0:
+        return fd, is_anonymous
+    
+    try:
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                # Contiguous extents up front, and ENOSPC now instead of mid-download
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+            # File system can't preallocate, just set the size
+            os.ftruncate(fd, total_size)
+    except BaseException:
+        os.close(fd)
+        raise
+    
+    return fd, is_anonymous
+
+
+def _publish(fd: int, local_path: str, is_anonymous: bool) -> None:
+    """Give a finished O_TMPFILE download its name at local_path."""
+    if not is_anonymous:
+        return
+    
+    try:
+        os.link(f'/proc/self/fd/{fd}', local_path)
+        return
+    except OSError as e:
+        # /proc can be missing or on another mount in some sandboxes
+        logger.warning(f"Could not link temp file ({e}), copying it instead")
+    
+    size = os.fstat(fd).st_size
+    out_fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out_fd, fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    finally:
+        os.close(out_fd)
+
+
+class FileTooLargeError(ValueError):
+    """The file is bigger than the caller's size limit."""
+    
+    def __init__(self, size: int, max_size: int):
+        super().__init__(f"File too large: {size} bytes (max {max_size})")
+        self.size = size
+        self.max_size = max_size
+
+
+class _RangeUnsupported(Exception):
+    """A ranged download can't be completed, fall back to a single stream."""
+
+
+def _range_validator(headers) -> Optional[str]:
+    """
+    Return a strong validator (ETag or Last-Modified) for If-Range.
+    Returns None if the response has none, weak ETags can't be used.
+    """
+    etag = headers.get('ETag', '')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified') or None
+
+
+async def _download_range(
+    session: aiohttp.ClientSession,
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    total_size: int,
+    validator: str,
+    timeout: aiohttp.ClientTimeout,
+    on_chunk: Callable[[int], Awaitable[None]]
+) -> None:
+    """Fetch bytes start..end (inclusive) and write them at the same offset in fd."""
+    # If-Range makes the server send 200 instead if the file has changed
+    headers = {'Range': f'bytes={start}-{end}', 'If-Range': validator}
+    async with session.get(url, headers=headers, timeout=timeout) as response:
+        if response.status != 206:
+            raise _RangeUnsupported(f"range request answered with HTTP {response.status}")
+        
+        match = _CONTENT_RANGE_RE.fullmatch(response.headers.get('Content-Range', '').strip())
+        if not match or tuple(map(int, match.groups())) != (start, end, total_size):
+            raise _RangeUnsupported(
+                f"unexpected Content-Range {response.headers.get('Content-Range')!r}"
+            )
+        
+        offset = start
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                # pwrite needs no shared file position, so parts never contend
+                await asyncio.to_thread(os.pwrite, fd, chunk, offset)
+                offset += len(chunk)
+                await on_chunk(len(chunk))
+        except aiohttp.ClientPayloadError as e:
+            raise _RangeUnsupported(f"range body cut short: {e}") from e
+    
+    if offset != end + 1:
+        raise _RangeUnsupported(f"incomplete range: got {offset - start} of {end - start + 1} bytes")
+
+
+async def _download_ranges(
+    session: aiohttp.ClientSession,
+    url: str,
+    local_path: str,
+    total_size: int,
+    validator: str,
+    timeout: aiohttp.ClientTimeout,
+    on_chunk: Callable[[int], Awaitable[None]]
+) -> None:
+    """
+    Download the file as RANGE_PARTS concurrent byte ranges into local_path.
+    
+    Raises:
+        _RangeUnsupported: If any part isn't served as the expected range
+    """
+    part_size = -(-total_size // RANGE_PARTS)  # ceil division
+    parts = [
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ]
+    
+    # Size the file up front so every part can write into its own slice
+    fd, is_anonymous = await asyncio.to_thread(_open_download, local_path, total_size)
+    try:
+        tasks = [
+            asyncio.create_task(
+                _download_range(
+                    session, url, fd, start, end, total_size, validator, timeout, on_chunk
+                )
+            )
+            for start, end in parts
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One part failed, don't leave the others writing to a closed fd
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        
+        await asyncio.to_thread(_publish, fd, local_path, is_anonymous)
+    finally:
+        os.close(fd)
+
+
+async def _download_stream(
+    response: aiohttp.ClientResponse,
+    local_path: str,
+    total_size: int,
+    chunk_size: int,
+    on_chunk: Callable[[int], Awaitable[None]]
+) -> None:
+    """Write the body of response to local_path through a buffered writer."""
+    fd, is_anonymous = await asyncio.to_thread(_open_download, local_path, total_size)
+    with os.fdopen(fd, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            # Keep blocking disk writes off the event loop
+            await asyncio.to_thread(f.write, chunk)
+            await on_chunk(len(chunk))
+        
+        await asyncio.to_thread(f.flush)
+        await asyncio.to_thread(_publish, fd, local_path, is_anonymous)
+
+
+async def download_file(
+    session: aiohttp.ClientSession,
+    url: str,
+    progress_callback: Optional[Callable[[int], Awaitable[None]]] = None,
+    timeout: int = READ_TIMEOUT,
+    max_size: Optional[int] = None
 ) -> str:
     """
     Download file from URL with progress tracking.
     
     Args:
+        session: The aiohttp session used for the requests
         url: The download URL
-        progress_callback: Optional callback function(percent: int)
+        progress_callback: Optional coroutine function(percent: int)
         timeout: Read timeout in seconds
+        max_size: Optional size limit in bytes, checked before any disk space is used
         
     Returns:
-        Path to the downloaded file
+        Path to the downloaded file, inside its own temp directory.
+        Delete it with remove_download().
         
     Raises:
-        requests.exceptions.Timeout: On timeout
-        requests.exceptions.RequestException: On other request errors
-        ValueError: On invalid response
+        TimeoutError: On timeout
+        ValueError: On HTTP error responses
+        FileTooLargeError: If the file is bigger than max_size
+        ConnectionError: On connection failures
+        RuntimeError: On other request errors
+        OSError: On file system errors
     """
     logger.info(f"Starting download from: {url}")
     
-    # Prepare timeout tuple (connect, read)
-    full_timeout = (CONNECT_TIMEOUT, timeout)
-    
-    try:
-        # Send HEAD request first to get Content-Length and filename
-        head_response = requests.head(
-            url,
-            timeout=(CONNECT_TIMEOUT, 10),
-            allow_redirects=True
-        )
-        
-        # Try to get filename from headers, fallback to URL
-        filename = extract_filename_from_headers(head_response.headers)
-        if not filename:
-            filename = extract_filename_from_url(url)
-        
-        # Get file size if available
-        total_size = int(head_response.headers.get('Content-Length', 0))
-        if total_size > 0:
-            logger.info(f"File size: {total_size / (1024**2):.2f} MB")
-        
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"HEAD request failed, proceeding with GET: {e}")
-        filename = extract_filename_from_url(url)
-        total_size = 0
-    
-    # Create temp file path
-    temp_dir = tempfile.gettempdir()
-    local_path = os.path.join(temp_dir, filename)
+    # Prepare timeout (connect, read)
+    full_timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=timeout)
     
-    # Ensure temp directory exists
-    os.makedirs(temp_dir, exist_ok=True)
+    # Set once the response headers have arrived
+    local_path = None
     
     # Download the file
     try:
-        with requests.get(
-            url,
-            stream=True,
-            timeout=full_timeout,
-            allow_redirects=True
-        ) as response:
+        async with await _get_with_retries(session, url, full_timeout) as response:
             
             # Check for HTTP errors
             response.raise_for_status()
             
-            # Update total size if not found in HEAD request
-            if total_size == 0:
-                total_size = int(response.headers.get('Content-Length', 0))
+            # Try to get filename from headers, fallback to the final (post-redirect) URL
+            filename = extract_filename_from_headers(response.headers)
+            if not filename:
+                filename = extract_filename_from_url(str(response.url))
+            
+            # Get file size if available
+            total_size = int(response.headers.get('Content-Length', 0))
+            if total_size > 0:
+                logger.info(f"File size: {total_size / (1024**2):.2f} MB")
+            
+            # Refuse oversized files before reserving any disk space
+            if max_size is not None and total_size > max_size:
+                raise FileTooLargeError(total_size, max_size)
+            
+            # Private temp directory per download, so equal filenames can't collide
+            temp_dir = tempfile.mkdtemp(prefix='dl_')
+            local_path = os.path.join(temp_dir, filename)
             
             # Download and write to file
             received = 0
             last_percent = -1
             
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-                    if chunk:
-                        f.write(chunk)
-                        received += len(chunk)
-                        
-                        # Update progress
-                        if progress_callback and total_size > 0:
-                            current_percent = math.floor(received / total_size * 100)
-                            if current_percent > last_percent:
-                                progress_callback(current_percent)
-                                last_percent = current_percent
+            # Only recompute the percentage once ~1% more has arrived
+            report_step = total_size // 100
+            last_reported = 0
+            
+            async def track_chunk(size: int):
+                """Count received bytes and report progress."""
+                nonlocal received, last_percent, last_reported
+                received += size
+                
+                # Content-Length can be missing or wrong, so enforce it here too
+                if max_size is not None and received > max_size:
+                    raise FileTooLargeError(received, max_size)
+                
+                if not progress_callback or total_size == 0:
+                    return
+                if received - last_reported < report_step:
+                    return
+                
+                last_reported = received
+                # A body decoded past Content-Length must not report over 100%
+                current_percent = min(received * 100 // total_size, 100)
+                if current_percent > last_percent:
+                    await progress_callback(current_percent)
+                    last_percent = current_percent
+            
+            # Nothing to report, copy the body in big blocks
+            if not progress_callback or total_size == 0:
+                chunk_size = WRITE_BUFFER_SIZE
+            else:
+                chunk_size = CHUNK_SIZE
             
-            # Ensure 100% callback
-            if progress_callback and total_size > 0 and last_percent < 100:
-                progress_callback(100)
+            # Ranges are only safe when If-Range can pin them to one version
+            validator = _range_validator(response.headers)
+            use_ranges = (
+                total_size >= MIN_RANGE_SIZE
+                and response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                and validator is not None
+            )
             
-            logger.info(f"Download complete: {local_path} ({received / (1024**2):.2f} MB)")
-            return local_path
+            if use_ranges:
+                # Abandon the single stream, the parts are fetched separately
+                response.close()
+            else:
+                await _download_stream(response, local_path, total_size, chunk_size, track_chunk)
+        
+        if use_ranges:
+            logger.info(f"Server accepts ranges, downloading in {RANGE_PARTS} parts")
+            try:
+                await _download_ranges(
+                    session,
+                    str(response.url),
+                    local_path,
+                    total_size,
+                    validator,
+                    full_timeout,
+                    track_chunk
+                )
+            except _RangeUnsupported as e:
+                logger.warning(f"Ranged download failed ({e}), retrying as a single stream")
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                received = 0
+                last_reported = 0
+                last_percent = -1
+                
+                async with await _get_with_retries(session, url, full_timeout) as response:
+                    response.raise_for_status()
+                    # The file may have changed, so its size may have too
+                    total_size = int(response.headers.get('Content-Length', 0))
+                    if max_size is not None and total_size > max_size:
+                        raise FileTooLargeError(total_size, max_size)
+                    report_step = total_size // 100
+                    await _download_stream(
+                        response, local_path, total_size, chunk_size, track_chunk
+                    )
+            
+        # Ensure 100% callback
+        if progress_callback and total_size > 0 and last_percent < 100:
+            await progress_callback(100)
+        
+        logger.info(f"Download complete: {local_path} ({received / (1024**2):.2f} MB)")
+        return local_path
     
-    except requests.exceptions.Timeout as e:
+    except asyncio.TimeoutError as e:
         logger.error(f"Download timeout for {url}: {e}")
         # Clean up partial file
-        if os.path.exists(local_path):
-            os.remove(local_path)
+        if local_path:
+            remove_download(local_path)
         raise TimeoutError(
             f"Download timed out after {timeout}s. "
             "The server may be slow or the file too large."
         ) from e
     
-    except requests.exceptions.HTTPError as e:
+    except aiohttp.ClientResponseError as e:
         logger.error(f"HTTP error downloading {url}: {e}")
-        if os.path.exists(local_path):
-            os.remove(local_path)
-        raise ValueError(f"HTTP error: {e.response.status_code} - {e.response.reason}") from e
+        if local_path:
+            remove_download(local_path)
+        raise ValueError(f"HTTP error: {e.status} - {e.message}") from e
     
-    except requests.exceptions.ConnectionError as e:
+    except FileTooLargeError as e:
+        logger.info(f"Refusing {url}: {e}")
+        if local_path:
+            remove_download(local_path)
+        raise
+    
+    except ValueError as e:
+        logger.error(f"Invalid response downloading {url}: {e}")
+        if local_path:
+            remove_download(local_path)
+        raise
+    
+    except aiohttp.ClientConnectionError as e:
         logger.error(f"Connection error downloading {url}: {e}")
-        if os.path.exists(local_path):
-            os.remove(local_path)
+        if local_path:
+            remove_download(local_path)
         raise ConnectionError("Failed to connect to the server. Check the URL and try again.") from e
     
-    except requests.exceptions.RequestException as e:
+    except aiohttp.ClientError as e:
         logger.error(f"Request error downloading {url}: {e}")
-        if os.path.exists(local_path):
-            os.remove(local_path)
+        if local_path:
+            remove_download(local_path)
         raise RuntimeError(f"Download failed: {str(e)}") from e
     
     except OSError as e:
         logger.error(f"File system error: {e}")
-        if os.path.exists(local_path):
-            os.remove(local_path)
-        raise OSError(f"Failed to write file: {str(e)}") from e
\ No newline at end of file
+        if local_path:
+            remove_download(local_path)
+        raise OSError(f"Failed to write file: {str(e)}") from e
+    
+    except BaseException:
+        # Cancelled (e.g. on shutdown) or unexpected, don't leave the temp dir behind
+        if local_path:
+            remove_download(local_path)
+        raise
\ No newline at end of file
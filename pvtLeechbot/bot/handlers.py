@@ -1,11 +1,10 @@
 """
 handlers.py - Bot Command and Message Handlers
 """
-import os
 import asyncio
+import datetime
 import logging
-import time
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from telegram.ext import (
     CommandHandler, 
     MessageHandler, 
@@ -14,20 +13,24 @@ from telegram.ext import (
     ContextTypes
 )
 from telegram.error import RetryAfter, TelegramError
-from bot.downloader import download_file
+from bot.downloader import download_file, get_session, remove_download, FileTooLargeError
 from bot.validators import is_valid_url, check_rate_limit
-from config.settings import DUMP_CHANNEL_ID, MAX_FILE_SIZE
-from concurrent.futures import ThreadPoolExecutor
+from config.settings import DUMP_CHANNEL_ID, MAX_FILE_SIZE, MAX_CONCURRENT_DOWNLOADS
 
 logger = logging.getLogger(__name__)
 
-# Thread pool for concurrent downloads
-executor = ThreadPoolExecutor(max_workers=3)
+# Caps concurrent downloads bot-wide, they all share the event loop
+DOWNLOAD_SEM = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
 
 # Throttling for progress updates
-last_update_time = {}
 MIN_EDIT_DELAY = 2.0  # seconds between progress edits
 
+# Prebuilt 20-char progress bars, one per 5% step
+_BARS = tuple('█' * i + '░' * (20 - i) for i in range(21))
+
+# Read buffer for uploads (1MB)
+UPLOAD_BUFFER_SIZE = 1 << 20
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command."""
@@ -98,24 +101,25 @@ async def handle_format_selection(update: Update, context: ContextTypes.DEFAULT_
     
     chat_id = query.message.chat_id
     status_msg = await query.edit_message_text("⏳ Starting download...")
-    msg_key = f"{chat_id}_{status_msg.message_id}"
     
-    loop = asyncio.get_running_loop()
-
-    def progress_callback(percent: int):
-        """Update download progress with throttling."""
-        current_time = time.time()
-        
-        if current_time - last_update_time.get(msg_key, 0) < MIN_EDIT_DELAY and percent < 100:
-            return
-
-        last_update_time[msg_key] = current_time
-
-        async def edit_status():
+    # Holds only the newest percentage, older unsent values are replaced
+    progress_q: asyncio.Queue = asyncio.Queue(maxsize=1)
+    
+    async def progress_callback(percent: int):
+        """Queue download progress without waiting on Telegram."""
+        try:
+            progress_q.put_nowait(percent)
+        except asyncio.QueueFull:
+            progress_q.get_nowait()
+            progress_q.put_nowait(percent)
+
+    async def emit_progress():
+        """Edit the status message with the latest progress, throttled."""
+        while True:
+            percent = await progress_q.get()
+            delay = MIN_EDIT_DELAY
             try:
-                bar_length = 20
-                filled = int(bar_length * percent / 100)
-                bar = '█' * filled + '░' * (bar_length - filled)
+                bar = _BARS[min(percent, 100) // 5]
                 
                 await context.bot.edit_message_text(
                     chat_id=chat_id,
@@ -124,61 +128,63 @@ async def handle_format_selection(update: Update, context: ContextTypes.DEFAULT_
                 )
             except RetryAfter as e:
                 logger.warning(f"Throttled during progress: Retry in {e.retry_after}s")
+                # Honour Telegram's flood-control wait before the next edit
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                delay = max(MIN_EDIT_DELAY, retry_after)
             except TelegramError:
                 pass  # Ignore "message not modified" errors
-        
-        if loop.is_running():
-            asyncio.run_coroutine_threadsafe(edit_status(), loop)
+            
+            if percent >= 100:
+                return
+            await asyncio.sleep(delay)
 
+    emitter = asyncio.create_task(emit_progress())
     local_path = None
     try:
-        # Download file in thread pool
-        local_path = await loop.run_in_executor(
-            executor,
-            download_file,
-            download_url,
-            progress_callback
-        )
-
-        # Check file size
-        file_size = os.path.getsize(local_path)
-        if file_size > MAX_FILE_SIZE:
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=status_msg.message_id,
-                text=f"❌ File too large ({file_size / (1024**3):.2f} GB). Max: 2GB"
+        # Stream the download on the event loop
+        async with DOWNLOAD_SEM:
+            local_path = await download_file(
+                get_session(),
+                download_url,
+                progress_callback,
+                max_size=MAX_FILE_SIZE
             )
-            return
+        
+        # Later status edits must not be overwritten by a late progress edit
+        emitter.cancel()
 
         await context.bot.edit_message_text(
             chat_id=chat_id,
             message_id=status_msg.message_id,
-            text="✅ Download complete. Uploading to dump channel..."
+            text="✅ Download complete. Uploading..."
         )
 
-        # Upload to dump channel
-        with open(local_path, "rb") as f:
+        # Upload once, straight to the user
+        with open(local_path, "rb", buffering=UPLOAD_BUFFER_SIZE) as f:
+            # Hand the open file to the HTTP client so it is streamed
+            # instead of being read into memory first
+            upload = InputFile(f, read_file_handle=False)
             if format_type == "video":
-                sent_message = await context.bot.send_video(
-                    chat_id=DUMP_CHANNEL_ID,
-                    video=f,
+                sent_message = await query.message.reply_video(
+                    video=upload,
                     supports_streaming=True
                 )
             else:
-                sent_message = await context.bot.send_document(
-                    chat_id=DUMP_CHANNEL_ID,
-                    document=f
-                )
+                sent_message = await query.message.reply_document(document=upload)
         
-        logger.info(f"File sent to dump channel as {format_type}")
-
-        # Send to user using file_id
-        file_id = sent_message.video.file_id if format_type == "video" else sent_message.document.file_id
-        
-        if format_type == "video":
-            await query.message.reply_video(video=file_id)
-        else:
-            await query.message.reply_document(document=file_id)
+        logger.info(f"File sent to user as {format_type}")
+
+        # Keep a copy in the dump channel, copyMessage reuses the uploaded file
+        try:
+            await context.bot.copy_message(
+                chat_id=DUMP_CHANNEL_ID,
+                from_chat_id=chat_id,
+                message_id=sent_message.message_id
+            )
+        except TelegramError as e:
+            logger.warning(f"Failed to copy file to dump channel: {e}")
         
         await context.bot.edit_message_text(
             chat_id=chat_id,
@@ -191,6 +197,13 @@ async def handle_format_selection(update: Update, context: ContextTypes.DEFAULT_
         logger.error(f"Flood control: {error_text}")
         await query.message.reply_text(error_text)
         
+    except FileTooLargeError as e:
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=status_msg.message_id,
+            text=f"❌ File too large ({e.size / (1024**3):.2f} GB). Max: 2GB"
+        )
+        
     except FileNotFoundError:
         error_text = "❌ Download failed: File not found at URL"
         logger.error(error_text)
@@ -207,13 +220,12 @@ async def handle_format_selection(update: Update, context: ContextTypes.DEFAULT_
         await query.message.reply_text(error_text)
 
     finally:
-        # Clean up temp file
-        if local_path and os.path.exists(local_path):
-            try:
-                os.remove(local_path)
-                logger.info(f"Cleaned up: {local_path}")
-            except OSError as e:
-                logger.warning(f"Failed to remove {local_path}: {e}")
+        emitter.cancel()
+        
+        # Clean up temp file and its directory
+        if local_path:
+            remove_download(local_path)
+            logger.info(f"Cleaned up: {local_path}")
         
         # Clear user data
         context.user_data.pop('download_url', None)
@@ -223,11 +235,4 @@ def register_handlers(app):
     """Register all command and message handlers."""
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(handle_format_selection, pattern="^format_"))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-
-def cleanup_executor():
-    """Gracefully shutdown the thread pool."""
-    logger.info("Shutting down thread pool executor...")
-    executor.shutdown(wait=True, cancel_futures=False)
-    logger.info("Thread pool executor shut down.")
\ No newline at end of file
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
\ No newline at end of file
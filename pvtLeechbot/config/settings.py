@@ -12,7 +12,7 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not found in environment variables!")
 
-# Dump Channel ID (where files are stored before sending to user)
+# Dump Channel ID (where a copy of every sent file is kept)
 DUMP_CHANNEL_ID = os.getenv("DUMP_CHANNEL_ID")
 if not DUMP_CHANNEL_ID:
     raise ValueError("DUMP_CHANNEL_ID not found in environment variables!")
@@ -34,5 +34,5 @@ REQUEST_COOLDOWN = 10  # seconds between requests per user
 CONNECT_TIMEOUT = 30  # seconds to establish connection
 READ_TIMEOUT = 1800  # seconds for download (30 minutes)
 
-# Thread pool settings
-MAX_WORKERS = 3  # Maximum concurrent downloads
\ No newline at end of file
+# Download concurrency
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "16"))
\ No newline at end of file
@@ -3,8 +3,10 @@ main.py - Bot Entry Point
 """
 from telegram.ext import ApplicationBuilder
 from telegram.request import HTTPXRequest
+import orjson
 from config.settings import BOT_TOKEN
-from bot.handlers import register_handlers, cleanup_executor
+from bot.handlers import register_handlers
+from bot.downloader import close_session
 import logging
 
 logging.basicConfig(
@@ -14,15 +16,41 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that parses Telegram's JSON responses with orjson."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Let the stock parser handle invalid UTF-8 and report errors
+            return HTTPXRequest.parse_json_payload(payload)
+
+
+async def post_shutdown(app):
+    """Release the shared download session before the event loop closes."""
+    await close_session()
+
+
 def main():
     """Main entry point for the Telegram bot."""
     # Increase timeout for handling large file downloads
-    request = HTTPXRequest(
+    request = OrjsonRequest(
         read_timeout=600,
         connect_timeout=60
     )
 
-    app = ApplicationBuilder().token(BOT_TOKEN).request(request).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .get_updates_request(OrjsonRequest())
+        .post_shutdown(post_shutdown)
+        # Handle updates in parallel, DOWNLOAD_SEM caps the downloads
+        .concurrent_updates(True)
+        .build()
+    )
     register_handlers(app)
 
     logger.info("🚀 Bot started polling...")
@@ -31,9 +59,6 @@ def main():
     except KeyboardInterrupt:
         logger.info("\n⏹️  Received shutdown signal...")
     finally:
-        # Gracefully shut down resources
-        logger.info("🧹 Cleaning up resources...")
-        cleanup_executor()
         logger.info("✅ Bot stopped gracefully.")
 
 